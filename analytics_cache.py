@@ -0,0 +1,45 @@
+"""
+Small TTL memo for expensive analytics results.
+
+The dashboard polls summary statistics far more often than new events
+arrive, so results are cached for a few seconds. The MQTT ingest path
+bumps a version counter after persisting new events; the counter is part
+of every cache key, so ingestion invalidates cached results immediately
+instead of waiting for the TTL to lapse.
+"""
+
+import time
+from functools import lru_cache, wraps
+
+# Bumped whenever new events are persisted; stale entries simply stop
+# being hit and age out of the LRU.
+_version = 0
+
+
+def bump_version():
+    """Invalidate all cached analytics results (called after ingest)."""
+    global _version
+    _version += 1
+
+
+def ttl_cache(seconds=5.0, maxsize=128):
+    """
+    Memoize a function of hashable arguments for up to `seconds`.
+
+    The wrapped function is keyed on its arguments, the current ingest
+    version and a coarse time bucket, so results are recomputed when new
+    data arrives or the TTL expires, whichever comes first.
+    """
+    def decorator(fn):
+        @lru_cache(maxsize=maxsize)
+        def _cached(_bucket, _version, args, kwargs_items):
+            return fn(*args, **dict(kwargs_items))
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            bucket = int(time.monotonic() / seconds)
+            return _cached(bucket, _version, args, tuple(sorted(kwargs.items())))
+
+        wrapper.cache_clear = _cached.cache_clear
+        return wrapper
+    return decorator
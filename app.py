@@ -1,21 +1,26 @@
-import json
-
 from flask import Flask, Response, jsonify, render_template, request
+from sqlalchemy import insert
 
-from config import MQTT_COMMAND_TOPIC, SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS
+from config import (
+    MQTT_COMMAND_TOPIC,
+    SQLALCHEMY_DATABASE_URI,
+    SQLALCHEMY_ENGINE_OPTIONS,
+    SQLALCHEMY_TRACK_MODIFICATIONS,
+)
 from mqtt_client import (
     launch_mqtt_thread,
-    latest_messages,
+    latest_messages_json,
+    message_stream,
     publish_message,
     register_flask_app,
-    subscribe_to_messages,
-    unsubscribe,
+    stream_stats,
 )
 from models import EVENT_TYPES, EventType, db
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = SQLALCHEMY_TRACK_MODIFICATIONS
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = SQLALCHEMY_ENGINE_OPTIONS
 
 db.init_app(app)
 
@@ -24,11 +29,13 @@ def init_db():
     """Create tables and seed event types to match current MQTT payloads."""
     with app.app_context():
         db.create_all()
-        existing = {et.event_type for et in EventType.query.all()}
-        to_add = [name for name in EVENT_TYPES if name not in existing]
-        if to_add:
-            db.session.add_all([EventType(event_type=name) for name in to_add])
-            db.session.commit()
+        # OR IGNORE skips names already present (event_type is unique), so
+        # seeding is one executemany instead of a select + diff + insert.
+        db.session.execute(
+            insert(EventType).prefix_with("OR IGNORE"),
+            [{"event_type": name} for name in EVENT_TYPES],
+        )
+        db.session.commit()
 
 
 # Ensure DB is ready and MQTT client can access the Flask app context
@@ -43,7 +50,12 @@ def index():
 
 @app.route("/api/messages")
 def api_messages():
-    return jsonify(latest_messages())
+    return Response(latest_messages_json(), mimetype="application/json")
+
+
+@app.route("/api/stats")
+def api_stats():
+    return jsonify(stream_stats())
 
 
 @app.post("/api/command")
@@ -61,13 +73,8 @@ def api_command():
 def api_events_stream():
     """Server-Sent Events endpoint for real-time message streaming."""
     def generate():
-        q = subscribe_to_messages()
-        try:
-            while True:
-                message = q.get()
-                yield f"data: {json.dumps(message)}\n\n"
-        except GeneratorExit:
-            unsubscribe(q)
+        for encoded in message_stream():
+            yield b"data: " + encoded + b"\n\n"
 
     return Response(
         generate(),
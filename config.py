@@ -3,6 +3,7 @@ import os
 # MQTT Configuration
 MQTT_BROKER = os.getenv("MQTT_BROKER", "alderaan.software-engineering.ie")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID") or None
 MQTT_EVENT_TOPIC = os.getenv("MQTT_EVENT_TOPIC", "computor/esp32/events")
 MQTT_COMMAND_TOPIC = os.getenv("MQTT_COMMAND_TOPIC", "computor/esp32/cmd")
 MAX_MESSAGES = int(os.getenv("MAX_MESSAGES", "10"))
@@ -10,3 +11,14 @@ MAX_MESSAGES = int(os.getenv("MAX_MESSAGES", "10"))
 # Database Configuration
 SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URI", "sqlite:///elevator_data.db")
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# The engine's pool is shared by Flask workers, the MQTT writer thread and
+# the analytics executor, so size it for that concurrency and verify pooled
+# connections before reuse. SQLite connections additionally must not be
+# pinned to their creating thread.
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": 8,
+    "pool_pre_ping": True,
+}
+if SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
+    SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {"check_same_thread": False}
@@ -1,9 +1,32 @@
-from flask_sqlalchemy import SQLAlchemy
+import sqlite3
 from datetime import datetime
 
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
 db = SQLAlchemy()
 
 
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tune SQLite for this workload on every new connection.
+
+    WAL lets dashboard reads proceed concurrently with MQTT ingest writes,
+    and NORMAL synchronous is safe under WAL while cutting commit latency.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-8192")  # 8 MB page cache
+    cursor.execute("PRAGMA mmap_size=134217728")  # 128 MB
+    cursor.close()
+
+
 class EventType(db.Model):
     """Lookup table for all possible event types"""
     __tablename__ = 'event_types'
@@ -26,6 +49,15 @@ class Event(db.Model):
     event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     floor = db.Column(db.Integer, nullable=True)  # Optional: for events related to specific floors
+
+    # Analytics queries filter on event_type_id (IN lists) optionally ranged by
+    # timestamp or grouped by floor; these indexes turn those scans into
+    # index-range scans. event_type_id comes first so it serves as the prefix.
+    __table_args__ = (
+        db.Index('ix_events_type_ts', 'event_type_id', 'timestamp'),
+        db.Index('ix_events_ts', 'timestamp'),
+        db.Index('ix_events_type_floor', 'event_type_id', 'floor'),
+    )
     
     def __repr__(self):
         return f'<Event {self.id}: {self.event_type_ref.event_type} at {self.timestamp}>'
@@ -1,149 +1,343 @@
+import itertools
+import logging
+import logging.handlers
+import re
 import threading
+import time
+from collections import deque
 from datetime import datetime, timezone
-from queue import Queue
-from typing import Any, Dict, List
+from queue import Empty, Full, Queue, SimpleQueue
+from typing import Any, Deque, Dict, List
 
 from flask import Flask
 
+import orjson
 import paho.mqtt.client as mqtt
 
 from config import (
     MAX_MESSAGES,
     MQTT_BROKER,
+    MQTT_CLIENT_ID,
     MQTT_COMMAND_TOPIC,
     MQTT_PORT,
     MQTT_EVENT_TOPIC,
 )
+from analytics_cache import bump_version
 from models import EVENT_TYPES, Event, EventType, db
 
-_latest_messages: List[Dict[str, Any]] = []
-_message_lock = threading.Lock()
-_message_id_counter = 0
+# Log records are only enqueued on the MQTT thread; a listener thread does
+# the actual stream writes, so a slow terminal/pipe never blocks ingest.
+# Per-message lines are DEBUG so their formatting is skipped entirely at
+# the default level.
+_log_queue: SimpleQueue = SimpleQueue()
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, logging.StreamHandler()
+)
+_log_listener.start()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+
+# maxlen makes append O(1) with automatic eviction of the oldest entry
+_latest_messages: Deque[Dict[str, Any]] = deque(maxlen=MAX_MESSAGES)
+# Newest-first views of the buffer, rebuilt on ingest and swapped in with a
+# single reference assignment (atomic under the GIL). Readers take no lock:
+# /api/messages returns the pre-encoded bytes and latest_messages() copies
+# the immutable snapshot tuple.
+_messages_json_cache: bytes = b"[]"
+_latest_snapshot: tuple = ()
+# The ingest worker is the only thread that mutates the buffer, counter and
+# caches, and readers only swap in immutable snapshots, so no lock is
+# needed; next() on itertools.count is itself thread-safe.
+_message_ids = itertools.count(1)
 _client: mqtt.Client | None = None
-_subscribers: List[Queue] = []
-_subscribers_lock = threading.Lock()
+# SSE fan-out: a shared ring of recent messages plus a condition variable.
+# Publishing is O(1) regardless of how many dashboards are streaming; each
+# subscriber tracks its own position in the sequence and reads by index.
+_RING_SIZE = 256
+_ring: Deque[bytes] = deque(maxlen=_RING_SIZE)
+_ring_cond = threading.Condition()
+_ring_seq = 0  # sequence number of the newest entry in the ring
+_dropped_total = 0  # messages aged out of the ring before a stream read them
 _flask_app: Flask | None = None
 
-
-def subscribe_to_messages() -> Queue:
-    """Subscribe to new messages. Returns a queue that receives new messages."""
-    q: Queue = Queue()
-    with _subscribers_lock:
-        _subscribers.append(q)
-    return q
-
-
-def unsubscribe(q: Queue):
-    """Unsubscribe from messages."""
-    with _subscribers_lock:
-        if q in _subscribers:
-            _subscribers.remove(q)
+# Raw (topic, payload, ts_ns) tuples from the paho callback. A dedicated
+# consumer thread drains them in batches, so the network callback does only
+# a cached decode and an enqueue, and the lock/ring/cache work amortizes
+# over bursts instead of running per message.
+_ingest_queue: SimpleQueue = SimpleQueue()
+_INGEST_BATCH_MAX = 100
+
+# Outbound publishes; a writer thread drains them so callers (HTTP request
+# handlers) return immediately instead of entering paho's socket write path.
+_out_queue: SimpleQueue = SimpleQueue()
+_PUBLISH_BATCH_MAX = 50
+
+# Events awaiting persistence; a background thread drains this so the MQTT
+# callback never waits on a DB commit, and commits amortize over batches.
+# The queue is bounded so a stalled database cannot grow memory without
+# limit, and batches are capped to keep individual commits short.
+_persist_queue: Queue = Queue(maxsize=10_000)
+_PERSIST_POLL_S = 0.05
+_PERSIST_BATCH_MAX = 500
+
+# Cached event_types lookup (name -> id); loaded once at registration since
+# the table is seeded at startup and never changes at runtime.
+_EVENT_TYPE_IDS: Dict[str, int] = {}
+
+# Event payloads come from a fixed vocabulary, so pre-decode the known byte
+# strings once; the common path then skips the UTF-8 decode and reuses one
+# interned str per event type. A cache hit also identifies the payload as a
+# known event, so no separate membership check is needed downstream.
+_PAYLOAD_CACHE: Dict[bytes, str] = {name.encode(): name for name in EVENT_TYPES}
+
+# Subscribed topics repeat from a tiny set (normally just MQTT_EVENT_TOPIC),
+# so intern them: every message then shares one str per distinct topic and
+# dict keys/equality checks reduce to pointer comparisons.
+_TOPIC_INTERN: Dict[str, str] = {MQTT_EVENT_TOPIC: MQTT_EVENT_TOPIC}
+
+
+def message_stream():
+    """
+    Yield JSON-encoded messages (bytes) as they arrive, starting after the
+    current newest one. Messages are serialized once on the publishing
+    side, so every open stream shares the same bytes, and each consumer
+    keeps its own position in the shared ring.
+
+    A consumer that falls more than the ring size behind skips ahead to
+    the oldest retained entry (drop-oldest backpressure): memory stays
+    bounded and a slow client can never stall the publisher.
+    """
+    global _dropped_total
+    with _ring_cond:
+        last_seq = _ring_seq
+    while True:
+        with _ring_cond:
+            _ring_cond.wait_for(lambda: _ring_seq > last_seq)
+            behind = _ring_seq - last_seq
+            missed = min(behind, len(_ring))
+            dropped = behind - missed
+            if dropped:
+                _dropped_total += dropped
+                logger.warning(
+                    "SSE stream fell behind; dropped %d message(s)", dropped
+                )
+            pending = list(_ring)[-missed:]
+            last_seq = _ring_seq
+        for encoded in pending:
+            yield encoded
+
+
+def stream_stats() -> dict[str, int]:
+    """Fan-out health counters for the diagnostics endpoint."""
+    with _ring_cond:
+        return {
+            "buffered": len(_ring),
+            "published": _ring_seq,
+            "dropped": _dropped_total,
+        }
 
 
-def _notify_subscribers(message: Dict[str, Any]):
-    """Notify all subscribers of a new message."""
-    with _subscribers_lock:
-        for q in _subscribers:
-            q.put(message)
+def _notify_subscribers(encoded_batch: List[bytes]):
+    """Publish encoded messages to the shared ring and wake all streams."""
+    global _ring_seq
+    with _ring_cond:
+        _ring.extend(encoded_batch)
+        _ring_seq += len(encoded_batch)
+        _ring_cond.notify_all()
 
 
 def register_flask_app(app: Flask):
     """Provide Flask app so the MQTT thread can open app contexts for DB writes."""
     global _flask_app
     _flask_app = app
+    with app.app_context():
+        _EVENT_TYPE_IDS.update(
+            (et.event_type, et.id) for et in EventType.query.all()
+        )
+    threading.Thread(target=_persist_worker, daemon=True).start()
+
+
+_FLOOR_RE = re.compile(r"^(?:stopped_at_floor_|cabin_button_|call_button_)(\d+)")
+
+def _parse_floor(event_type: str) -> int | None:
+    match = _FLOOR_RE.match(event_type)
+    return int(match.group(1)) if match else None
+
+
+# EVENT_TYPES is finite and known, so the floor for every name is computed
+# once at import; _extract_floor is then a single dict lookup with zero
+# allocations on the hot path.
+_FLOOR_TABLE: Dict[str, int | None] = {
+    name: _parse_floor(name) for name in EVENT_TYPES
+}
 
 
 def _extract_floor(event_type: str) -> int | None:
-    if event_type.startswith("stopped_at_floor_"):
-        try:
-            return int(event_type.rsplit("_", 1)[-1])
-        except ValueError:
-            return None
-    if event_type.startswith("cabin_button_"):
-        try:
-            return int(event_type.rsplit("_", 1)[-1])
-        except ValueError:
-            return None
-    if event_type.startswith("call_button_"):
-        tail = event_type[len("call_button_") :]
-        parts = tail.split("_", 1)
-        if parts and parts[0].isdigit():
-            return int(parts[0])
-    return None
-
-
-def _persist_event(message: Dict[str, Any]):
-    """Persist the MQTT message into the database using the payload as event_type."""
+    try:
+        return _FLOOR_TABLE[event_type]
+    except KeyError:
+        return _parse_floor(event_type)
+
+
+def _persist_event(payload: str, ts_ns: int):
+    """Queue a known event for persistence by the background writer.
+
+    Only the (payload, ts_ns) pair is queued - everything the writer needs -
+    so the retained message dicts stay with the reader-facing buffers and
+    the persist path allocates just one small tuple per event. Callers have
+    already established that the payload is a known event type.
+    """
     if _flask_app is None:
         return
 
-    payload = message.get("payload")
-    if not payload or payload not in EVENT_TYPES:
-        return
+    try:
+        _persist_queue.put_nowait((payload, ts_ns))
+    except Full:
+        # Never block the MQTT thread on a stalled database.
+        logger.warning("Persist queue full; dropping event '%s'", payload)
+
+
+def _event_timestamp(ts_ns: int) -> datetime:
+    # Stored timestamps are naive UTC, matching the column default.
+    return datetime.fromtimestamp(ts_ns / 1e9, tz=timezone.utc).replace(tzinfo=None)
+
 
-    ts_str = message.get("timestamp")
-    ts = None
-    if ts_str:
+def _persist_worker():
+    """Drain queued messages and persist each batch with one bulk insert."""
+    while True:
         try:
-            ts = datetime.fromisoformat(ts_str)
-        except ValueError:
-            ts = None
+            first = _persist_queue.get(timeout=_PERSIST_POLL_S)
+        except Empty:
+            continue
 
-    floor = _extract_floor(payload)
+        batch = [first]
+        while len(batch) < _PERSIST_BATCH_MAX:
+            try:
+                batch.append(_persist_queue.get_nowait())
+            except Empty:
+                break
 
+        _persist_batch(batch)
+
+
+def _persist_batch(batch: List[tuple]):
+    """Write a batch of (payload, ts_ns) events in a single commit."""
     try:
         with _flask_app.app_context():
-            event_type_row = EventType.query.filter_by(event_type=payload).first()
-            if event_type_row is None:
+            rows = []
+            for payload, ts_ns in batch:
+                etid = _EVENT_TYPE_IDS.get(payload)
+                if etid is None:
+                    # The type may have been seeded after the cache was
+                    # loaded (e.g. a fresh database); refresh once.
+                    _EVENT_TYPE_IDS.update(
+                        (et.event_type, et.id) for et in EventType.query.all()
+                    )
+                    etid = _EVENT_TYPE_IDS.get(payload)
+                if etid is None:
+                    continue
+                rows.append({
+                    "event_type_id": etid,
+                    "floor": _extract_floor(payload),
+                    "timestamp": _event_timestamp(ts_ns),
+                })
+            if not rows:
                 return
-            event = Event(event_type_id=event_type_row.id, floor=floor)
-            if ts is not None:
-                event.timestamp = ts
-            db.session.add(event)
+            # Core insert: one executemany straight to the table, skipping
+            # the ORM's per-object mapper machinery for this append-only path.
+            db.session.execute(Event.__table__.insert(), rows)
             db.session.commit()
+        bump_version()
     except Exception as exc:  # pragma: no cover - defensive logging
-        # Avoid crashing the MQTT thread if DB is unavailable.
+        # Avoid crashing the writer thread if DB is unavailable.
         try:
             db.session.rollback()
         except Exception:
             pass
-        print(f"[MQTT][DB] Failed to persist event '{payload}': {exc}")
+        logger.error("Failed to persist batch of %d: %s", len(batch), exc)
 
 
 def on_mqtt_connect(client: mqtt.Client, userdata=None, flags=None, reason_code=0, properties=None):
-    print(f"[MQTT] Connected and subscribing to {MQTT_EVENT_TOPIC}")
+    logger.info("Connected and subscribing to %s", MQTT_EVENT_TOPIC)
     client.subscribe(MQTT_EVENT_TOPIC)
 
 
 def on_mqtt_message(client: mqtt.Client, userdata, msg: mqtt.MQTTMessage):
-    global _message_id_counter
-    payload = msg.payload.decode("utf-8", errors="replace")
-    print(f"[MQTT] {msg.topic}: {payload}")
-
-    with _message_lock:
-        _message_id_counter += 1
+    # Keep paho's callback minimal: pin the arrival time, decode via the
+    # payload cache and hand off; the ingest worker does everything else.
+    # A payload-cache hit doubles as the "is this a known event?" check,
+    # since the cache holds exactly the EVENT_TYPES vocabulary.
+    ts_ns = time.time_ns()
+    cached = _PAYLOAD_CACHE.get(msg.payload)
+    is_event = cached is not None
+    payload = cached or msg.payload.decode("utf-8", errors="replace")
+    topic = _TOPIC_INTERN.get(msg.topic) or _TOPIC_INTERN.setdefault(
+        msg.topic, msg.topic
+    )
+    _ingest_queue.put((topic, payload, ts_ns, is_event))
+
+
+def _ingest_worker():
+    """Drain raw messages and process them one batch at a time."""
+    while True:
+        batch = [_ingest_queue.get()]
+        while len(batch) < _INGEST_BATCH_MAX:
+            try:
+                batch.append(_ingest_queue.get_nowait())
+            except Empty:
+                break
+        _ingest_batch(batch)
+
+
+def _ingest_batch(batch: List[tuple]):
+    """Buffer a batch of raw messages, then fan out and persist once."""
+    global _messages_json_cache, _latest_snapshot
+
+    encoded_batch = []
+    for topic, payload, ts_ns, is_event in batch:
         message = {
-            "id": _message_id_counter,
-            "topic": msg.topic,
+            "id": next(_message_ids),
+            "topic": topic,
             "payload": payload,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": datetime.fromtimestamp(
+                ts_ns / 1e9, tz=timezone.utc
+            ).isoformat(),
+            "timestamp_ns": ts_ns,
         }
+        logger.debug("%s: %s", topic, payload)
         _latest_messages.append(message)
-        del _latest_messages[:-MAX_MESSAGES]
+        encoded_batch.append(orjson.dumps(message))
 
-    _persist_event(message)
-    _notify_subscribers(message)
-    print(f"[MQTT] Stored message #{message['id']}. Total buffered: {len(_latest_messages)}")
+    newest_first = list(reversed(_latest_messages))
+    _messages_json_cache = orjson.dumps(newest_first)
+    _latest_snapshot = tuple(newest_first)
+
+    _notify_subscribers(encoded_batch)
+    for topic, payload, ts_ns, is_event in batch:
+        if is_event:
+            _persist_event(payload, ts_ns)
+    logger.debug(
+        "Stored %d message(s). Total buffered: %d",
+        len(batch), len(_latest_messages),
+    )
 
 
 def start_mqtt_loop():
     global _client
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=MQTT_CLIENT_ID)
     client.on_connect = on_mqtt_connect
     client.on_message = on_mqtt_message
-    print(f"[MQTT] Connecting to {MQTT_BROKER}:{MQTT_PORT}")
+    # Size paho's internal queues for bursts so its locks don't contend
+    # with ours, and back off reconnects instead of hammering the broker.
+    client.max_inflight_messages_set(1000)
+    client.max_queued_messages_set(100_000)
+    client.reconnect_delay_set(min_delay=1, max_delay=30)
+    logger.info("Connecting to %s:%s", MQTT_BROKER, MQTT_PORT)
     client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
     _client = client
+    threading.Thread(target=_publish_worker, daemon=True).start()
     client.loop_forever()
 
 
@@ -153,8 +347,14 @@ def launch_mqtt_thread():
 
 
 def latest_messages() -> list[dict[str, Any]]:
-    with _message_lock:
-        return list(reversed(_latest_messages))
+    # Reading the snapshot reference is atomic under the GIL, so readers
+    # never contend with the MQTT ingest thread.
+    return list(_latest_snapshot)
+
+
+def latest_messages_json() -> bytes:
+    """Return the buffered messages, newest first, as pre-encoded JSON."""
+    return _messages_json_cache
 
 
 def publish_message(
@@ -167,9 +367,47 @@ def publish_message(
     if topic is None:
         topic = MQTT_COMMAND_TOPIC
     if _client is None:
-        print("[MQTT] Publish failed: client not connected yet")
+        logger.warning("Publish failed: client not connected yet")
         return False
-    result = _client.publish(topic, payload=payload, qos=qos, retain=retain)
-    ok = result.rc == mqtt.MQTT_ERR_SUCCESS
-    print(f"[MQTT] Publish to {topic}: {payload} (ok={ok})")
-    return ok
+    _out_queue.put((topic, payload, qos, retain))
+    return True
+
+
+def _publish_worker():
+    """Drain queued publishes and hand them to the paho client in batches.
+
+    Within a drained window, duplicate qos-0 non-retained (topic, payload)
+    pairs are coalesced to the most recent occurrence - repeated control
+    button presses collapse to one publish.
+    """
+    while True:
+        batch = [_out_queue.get()]
+        while len(batch) < _PUBLISH_BATCH_MAX:
+            try:
+                batch.append(_out_queue.get_nowait())
+            except Empty:
+                break
+
+        to_send = []
+        seen = set()
+        for item in reversed(batch):
+            topic, payload, qos, retain = item
+            if qos == 0 and not retain:
+                key = (topic, payload)
+                if key in seen:
+                    continue
+                seen.add(key)
+            to_send.append(item)
+
+        for topic, payload, qos, retain in reversed(to_send):
+            if _client is None:
+                logger.warning("Publish dropped: client not connected yet")
+                continue
+            result = _client.publish(topic, payload=payload, qos=qos, retain=retain)
+            ok = result.rc == mqtt.MQTT_ERR_SUCCESS
+            logger.debug("Publish to %s: %s (ok=%s)", topic, payload, ok)
+
+
+# The ingest worker has no Flask dependency, so it starts with the module
+# (like the log listener) rather than waiting for register_flask_app.
+threading.Thread(target=_ingest_worker, daemon=True).start()